@@ -0,0 +1,33 @@
+#  ___________________________________________________________________________
+#
+#  Progressive Hedging rho setter for the three-stage scenario model
+#  
+#  Author: Wyatt Arnold
+#  References: Watson & Woodruff 2011
+#  ___________________________________________________________________________
+
+#
+# sh command
+#
+
+# runph -m=three_stage_scenario.py --solver=gurobi_persistent --solver-options="Method=1 LPWarmStart=2" --default-rho=1 --rho-cfgfile=rhosetter.py --solution-writer=pyomo.pysp.plugins.csvsolutionwriter
+
+
+
+#
+# Cost-proportional rho on the first-stage (Root) decisions
+#
+
+RHO_MULTIPLIER = 1.0
+
+def ph_rhosetter_callback(ph, scenario_tree, scenario):
+
+    root_node = scenario_tree.findRootNode()
+    instance = scenario._instance
+
+    for i in instance.LT:
+        variable_id = root_node._name_index_to_id[("LT_ACTION", i)]
+        ph.setRhoOneScenario(root_node, scenario, variable_id,
+                             RHO_MULTIPLIER * instance.C_LT[i])
+
+    # MT_EXP (projection nodes) keeps the --default-rho value
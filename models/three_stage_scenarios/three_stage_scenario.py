@@ -11,7 +11,8 @@
 # Imports
 #
 
-import os,json
+import os, json, functools
+import numpy as np
 import networkx 
 import pyomo.environ as pyo
 
@@ -56,6 +57,10 @@ model.SHORTAGE_Q = pyo.Param(model.SHORTAGE,
                              initialize=0.0,
                              mutable=True)
 
+# set members materialized once for iteration in rules
+_LT = tuple(data['LT_MAX'])
+_ST = tuple(data['ST_MAX'])
+
 #
 # Variables
 #
@@ -72,14 +77,51 @@ model.ST_Q = pyo.Var(model.ST,
                      bounds=(0, None),
                      within=pyo.NonNegativeReals)
 
+#
+# Linearization of LT_ACTION * MT_EXP (binary expansion of LT_ACTION)
+#
+
+LT_BITS = {i: range(int(data['LT_MAX'][i]).bit_length()) for i in _LT}
+
+model.LT_BIT = pyo.Set(dimen=2, initialize=[(i, b) for i in LT_BITS for b in LT_BITS[i]])
+
+model.LT_ACTION_BIT = pyo.Var(model.LT_BIT, 
+                              within=pyo.Binary)
+
+# MT_EXP * LT_ACTION_BIT
+model.MT_EXP_BIT = pyo.Var(model.LT_BIT, 
+                           bounds=(0, 1), 
+                           within=pyo.PercentFraction)
+
+def LongTermBinary_rule(model, i):
+    bits = pyo.quicksum(2**b * model.LT_ACTION_BIT[i,b] for b in LT_BITS[i])
+    return model.LT_ACTION[i] == bits
+model.LongTermBinary = pyo.Constraint(model.LT, rule=LongTermBinary_rule)
+
+def MidTermBitUpper_rule(model, i, b):
+    return model.MT_EXP_BIT[i,b] <= model.LT_ACTION_BIT[i,b]
+model.MidTermBitUpper = pyo.Constraint(model.LT_BIT, rule=MidTermBitUpper_rule)
+
+def MidTermExpUpper_rule(model, i, b):
+    return model.MT_EXP_BIT[i,b] <= model.MT_EXP[i]
+model.MidTermExpUpper = pyo.Constraint(model.LT_BIT, rule=MidTermExpUpper_rule)
+
+def MidTermExpLower_rule(model, i, b):
+    return model.MT_EXP_BIT[i,b] >= model.MT_EXP[i] - (1 - model.LT_ACTION_BIT[i,b])
+model.MidTermExpLower = pyo.Constraint(model.LT_BIT, rule=MidTermExpLower_rule)
+
+def mt_lt_action(model, i):
+    return pyo.quicksum(2**b * model.MT_EXP_BIT[i,b] for b in LT_BITS[i])
+model.MT_LT_ACTION = pyo.Expression(model.LT, rule=mt_lt_action)
+
 #
 # Constraints
 #
 
 def MeetShortage_rule(model):
     lt_q = pyo.sum_product(model.LT_QF, model.LT_ACTION)
-    mt_q = pyo.quicksum(model.LT_QF[i]*model.LT_ACTION[i]*model.MT_EXP[i] for i in model.LT)
-    st_q = pyo.quicksum(model.ST_Q[k] for k in model.ST)
+    mt_q = pyo.sum_product(model.LT_QF, model.MT_LT_ACTION)
+    st_q = pyo.quicksum(model.ST_Q[k] for k in _ST)
     tot_q = lt_q + mt_q + st_q
     return  tot_q >= model.SHORTAGE_Q['SH']
 model.MeetShortage = pyo.Constraint(rule=MeetShortage_rule)
@@ -94,7 +136,7 @@ model.MidTermMax = pyo.Constraint(model.MT, rule=MidTermMax_rule)
 
 def MidTermLSRetro_rule(model):
     lt_retro = model.LT_ACTION['LS_RETRO']
-    return lt_retro * model.MT_EXP['LS_RETRO'] + lt_retro <= model.LT_MAX['LS_RETRO']
+    return model.MT_LT_ACTION['LS_RETRO'] + lt_retro <= model.LT_MAX['LS_RETRO']
 model.MidTermLSRetro = pyo.Constraint(rule=MidTermLSRetro_rule)
 
 def ShortTermMax_rule(model, k):
@@ -104,7 +146,7 @@ model.ShortTermMax = pyo.Constraint(model.ST, rule=ShortTermMax_rule)
 def ShortTermRestrict_rule(model):
     lt_retro = model.LT_ACTION['LS_RETRO']
     st_q_ = model.ST_Q['LS_RESTRICT'] / model.LT_QF['LS_RETRO']
-    return st_q_ + lt_retro * model.MT_EXP['LS_RETRO'] + lt_retro  <= model.LT_MAX['LS_RETRO']
+    return st_q_ + model.MT_LT_ACTION['LS_RETRO'] + lt_retro  <= model.LT_MAX['LS_RETRO']
 model.ShortTermRestrict = pyo.Constraint(rule=ShortTermRestrict_rule)
 
 def LTOption_rule(model):
@@ -112,22 +154,10 @@ def LTOption_rule(model):
 model.LTOption = pyo.Constraint(rule=LTOption_rule)
 
 def MTOption_rule(model):
-    mt_option = model.LT_ACTION['OPTION'] * model.MT_EXP['OPTION']
+    mt_option = model.MT_LT_ACTION['OPTION']
     return model.ST_Q['EX_MT_OPTION'] <= mt_option
 model.MTOption = pyo.Constraint(rule=MTOption_rule)
 
-def ShortTermNonNegativity_rule(model, k):
-    return model.ST_Q[k] >= 0 
-model.ShortTermNonNegativity = pyo.Constraint(model.ST, rule=ShortTermNonNegativity_rule)
-
-def MidTermNonNegativity_rule(model, j):
-    return model.MT_EXP[j] >= 0 
-model.MidTermNonNegativity = pyo.Constraint(model.MT, rule=MidTermNonNegativity_rule)
-
-def LongTermNonNegativity_rule(model, i):
-    return model.LT_ACTION[i] >= 0
-model.LongTermNonNegativity = pyo.Constraint(model.LT, rule=LongTermNonNegativity_rule)
-
 #
 # Stage-specific cost computations
 #
@@ -137,7 +167,7 @@ def ComputeFirstStageCost_rule(model):
 model.FirstStageCost = pyo.Expression(rule=ComputeFirstStageCost_rule)
 
 def ComputeSecondStageCost_rule(model):
-    return pyo.quicksum(model.C_MT[i]*model.MT_EXP[i]*model.LT_ACTION[i]*model.LT_QF[i] for i in model.LT) + pyo.quicksum(1000*model.MT_EXP[i] for i in model.LT)
+    return pyo.quicksum(model.C_MT[i]*model.LT_QF[i]*model.MT_LT_ACTION[i] for i in _LT) + pyo.quicksum(1000*model.MT_EXP[i] for i in _LT)
 model.SecondStageCost = pyo.Expression(rule=ComputeSecondStageCost_rule)
 
 def ComputeThirdStageCost_rule(model):
@@ -167,24 +197,28 @@ model.Total_Cost_Objective = pyo.Objective(rule=total_cost_rule, sense=pyo.minim
 # Stochastic Data
 #
 
-SHORTAGE_Q = {}
-for projection in data['SHORTAGE_Q']: 
-    SHORTAGE_Q.update(data['SHORTAGE_Q'][projection])
+SHORTAGE_Q = {k: v for d in data['SHORTAGE_Q'].values() for k, v in d.items()}
+
+SHORTAGE_P = {k: v for d in data['SHORTAGE_P'].values() for k, v in d.items()}
+
+PROJECTION_ITEMS = list(data['PROJECTION_P'].items())
 
+SHORTAGE_ITEMS = {p: list(data['SHORTAGE_P'][p].items()) for p in data['PROJECTION_P']}
 
-SHORTAGE_P = {}
-for projection in data['SHORTAGE_P']: 
-    SHORTAGE_P.update(data['SHORTAGE_P'][projection])
+SCENARIO_INDEX = {name: i for i, name in enumerate(SHORTAGE_Q)}
+
+SHORTAGE_Q_ARRAY = np.fromiter((SHORTAGE_Q[name]['SH'] for name in SCENARIO_INDEX), dtype=np.float64)
 
 def pysp_instance_creation_callback(scenario_name, node_names):
 
     instance = model.clone()
-    instance.SHORTAGE_Q.store_values(SHORTAGE_Q[scenario_name])
+    instance.SHORTAGE_Q['SH'].set_value(float(SHORTAGE_Q_ARRAY[SCENARIO_INDEX[scenario_name]]))
 
     return instance
 
+@functools.lru_cache(maxsize=1)
 def pysp_scenario_tree_model_callback():
-    # Return a NetworkX scenario tree.
+    # Return a NetworkX scenario tree (cached within one import of this module; callers share the graph).
     g = networkx.DiGraph()
 
     ce1 = "CostExpressions[1]"
@@ -194,22 +228,22 @@ def pysp_scenario_tree_model_callback():
     g.add_node("Root",
                cost = ce1,
                variables = ["LT_ACTION[*]"],
-               derived_variables = [])
-
-    for projection in data['PROJECTION_P']:
-
-        g.add_node(projection,
-                    cost = ce2,
-                    variables = ["MT_EXP[*]"],
-                    derived_variables = [])
-        g.add_edge("Root", projection, weight=data['PROJECTION_P'][projection])
-
-        for shortage in data['SHORTAGE_P'][projection]:
-
-            g.add_node(shortage,
-                    cost = ce3,
-                    variables = ["ST_Q[*]"],
-                    derived_variables = [])
-            g.add_edge(projection, shortage, weight=data['SHORTAGE_P'][projection][shortage])
+               derived_variables = ["LT_ACTION_BIT[*,*]"])
+
+    g.add_nodes_from([(projection, {"cost": ce2,
+                                     "variables": ["MT_EXP[*]"],
+                                     "derived_variables": ["MT_EXP_BIT[*,*]"]})
+                      for projection, _ in PROJECTION_ITEMS])
+    g.add_edges_from([("Root", projection, {"weight": weight})
+                      for projection, weight in PROJECTION_ITEMS])
+
+    g.add_nodes_from([(shortage, {"cost": ce3,
+                                   "variables": ["ST_Q[*]"],
+                                   "derived_variables": []})
+                      for projection, _ in PROJECTION_ITEMS
+                      for shortage, _ in SHORTAGE_ITEMS[projection]])
+    g.add_edges_from([(projection, shortage, {"weight": weight})
+                      for projection, _ in PROJECTION_ITEMS
+                      for shortage, weight in SHORTAGE_ITEMS[projection]])
 
     return g
@@ -0,0 +1,39 @@
+#  ___________________________________________________________________________
+#
+#  Progressive Hedging rho setter for the three-stage stochastic model
+#  
+#  Author: Wyatt Arnold
+#  References: Watson & Woodruff 2011
+#  ___________________________________________________________________________
+
+#
+# sh command
+#
+
+# runph -m=three_stage.py --solver=gurobi_persistent --solver-options="NonConvex=2 Method=1 LPWarmStart=2" --default-rho=1 --rho-cfgfile=rhosetter.py --solution-writer=pyomo.pysp.plugins.csvsolutionwriter
+
+
+
+#
+# Cost-proportional rho on the first-stage (Root) decisions
+#
+
+RHO_MULTIPLIER = 1.0
+
+def ph_rhosetter_callback(ph, scenario_tree, scenario):
+
+    root_node = scenario_tree.findRootNode()
+    instance = scenario._instance
+
+    for i in instance.LT:
+        variable_id = root_node._name_index_to_id[("LT_ACTION", i)]
+        ph.setRhoOneScenario(root_node, scenario, variable_id,
+                             RHO_MULTIPLIER * instance.C_LT[i])
+
+    for i in instance.LT_EXP:
+        variable_id = root_node._name_index_to_id[("LT_EXP_PERMIT_ACTION", i)]
+        ph.setRhoOneScenario(root_node, scenario, variable_id,
+                             RHO_MULTIPLIER * instance.LT_EXP_PERMIT_COST[i])
+
+    # LT_EXP_ACTION is priced through the LT_EXP_COST variable (tangent cuts
+    # or piecewise curve) and keeps the --default-rho value
@@ -14,16 +14,21 @@
 # runef --solve -m=three_stage.py --solver=gurobi --solver-options="NonConvex=2 TimeLimit=60" --solution-writer=pyomo.pysp.plugins.csvsolutionwriter
 # runef --solve -m=three_stage.py --solver=gurobi --solver-options="NonConvex=2" --solution-writer=pyomo.pysp.plugins.csvsolutionwriter --generate-weighted-cvar --cvar-weight=0.1 --risk-alpha=0.95
 
+# progressive hedging (scenario decomposition), serial and one phsolverserver per scenario
+# runph -m=three_stage.py --solver=gurobi_persistent --solver-options="NonConvex=2 Method=1 LPWarmStart=2" --default-rho=1 --rho-cfgfile=rhosetter.py --solution-writer=pyomo.pysp.plugins.csvsolutionwriter
+# mpirun -np 1 pyomo_ns : -np 1 dispatch_srvr : -np 24 phsolverserver : -np 1 runph -m=three_stage.py --solver=gurobi_persistent --solver-options="NonConvex=2 Method=1 LPWarmStart=2" --default-rho=1 --rho-cfgfile=rhosetter.py --solver-manager=phpyro --shutdown-pyro --solution-writer=pyomo.pysp.plugins.csvsolutionwriter
+
 
 
 #
 # Imports
 #
 
-import os, json
+import os, json, functools
 import numpy as np
 import networkx 
 import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression
 
 
 
@@ -54,39 +59,41 @@ model.ST = pyo.Set(initialize=list(data['ST_MAX'].keys()))
 model.SHORTAGE = pyo.Set(initialize=['SH'])
 model.SHORT = pyo.Set(initialize=list(data['SHORT_Q_MAX']['P3'].keys()))
 
+# set members materialized once for iteration in rules
+_LT = tuple(data['LT_MAX'])
+_LT_EXP = tuple(data['LT_EXP'])
+_ST = tuple(data['ST_MAX'])
+
 
 
 #
 # Parameters
 #
 
-def lt_min(model, i):
-    return data['LT_MIN'][i]
-model.LT_MIN = pyo.Param(model.LT, within=pyo.NonNegativeReals, initialize=lt_min)
+model.LT_MIN = pyo.Param(model.LT, within=pyo.NonNegativeReals, initialize=data['LT_MIN'])
+
+model.LT_MAX = pyo.Param(model.LT, within=pyo.NonNegativeReals, initialize=data['LT_MAX'])
+
+model.C_LT = pyo.Param(model.LT, within=pyo.NonNegativeReals, initialize=data['C_LT'])
+
+model.ST_MIN = pyo.Param(model.ST, within=pyo.NonNegativeReals, initialize=data['ST_MIN'])
+
+model.ST_MAX = pyo.Param(model.ST, within=pyo.NonNegativeReals, initialize=data['ST_MAX'])
 
-def lt_max(model, i):
-    return data['LT_MAX'][i]
-model.LT_MAX = pyo.Param(model.LT, within=pyo.NonNegativeReals, initialize=lt_max)
+model.C_ST = pyo.Param(model.ST, within=pyo.NonNegativeReals, initialize=data['C_ST'])
 
-def c_lt(model, i):
-    return data['C_LT'][i]
-model.C_LT = pyo.Param(model.LT, within=pyo.NonNegativeReals, initialize=c_lt)
+def lt_exp(key):
+    return {i: data['LT_EXP'][i][key] for i in _LT_EXP}
 
-def st_min(model, i):
-    return data['ST_MIN'][i]
-model.ST_MIN = pyo.Param(model.ST, within=pyo.NonNegativeReals, initialize=st_min)
+model.LT_EXP_PERMIT_COST = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=lt_exp('permit_cost'))
 
-def st_max(model, i):
-    return data['ST_MAX'][i]
-model.ST_MAX = pyo.Param(model.ST, within=pyo.NonNegativeReals, initialize=st_max)
+model.EXP_MAX = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=lt_exp('exp_max'))
 
-def c_st(model, i):
-    return data['C_ST'][i]
-model.C_ST = pyo.Param(model.ST, within=pyo.NonNegativeReals, initialize=c_st)
+model.BASELINE_OP_COST = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=lt_exp('baseline_op_cost'))
 
-def exp_permit_cost(model, i):
-    return data['LT_EXP'][i]['permit_cost']
-model.LT_EXP_PERMIT_COST = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=exp_permit_cost)
+model.BASELINE_OP_MIN_RATIO = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=lt_exp('baseline_op_min_ratio'))
+
+model.VARIABLE_OP_COST = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=lt_exp('variable_op_cost'))
 
 
 # mutable parameters (per scenario)
@@ -116,6 +123,9 @@ model.EXP_BOP_ACTION = pyo.Var(model.LT_EXP, bounds=(0, None), within=pyo.NonNeg
 
 model.EXP_VOP_ACTION = pyo.Var(model.LT_EXP, bounds=(0, None), within=pyo.NonNegativeReals, initialize=0)
 
+# EXP_VOP_ACTION * LT_EXP_PERMIT_ACTION
+model.EXP_VOP_Z = pyo.Var(model.LT_EXP, bounds=(0, None), within=pyo.NonNegativeReals, initialize=0)
+
 model.SHORT_ACTION = pyo.Var(model.SHORT, 
                           bounds=(0, None),
                           within=pyo.NonNegativeReals, 
@@ -124,25 +134,55 @@ model.SHORT_ACTION = pyo.Var(model.SHORT,
 
 
 #
-# LT Expansion Piecewise functions
+# LT Expansion marginal cost functions
 #
 
-piecewise_representation = 'INC'
-
-bkpts = [0] + (np.arange(5e3,1.5e5,1e4)).tolist() + \
-        (np.arange(1.5e5,4.5e5,5e4)).tolist() + \
-        (np.arange(4.5e5,1.1e6,2e5)).tolist() 
-
-def scale_marginal(model, LT_EXP, LT_EXP_ACTION):
-    if LT_EXP_ACTION==0:
-        return 0
-    else:
-        p = data['LT_EXP'][LT_EXP]['p']
-        mult = data['LT_EXP'][LT_EXP]['multiplier']
-        return p * mult * LT_EXP_ACTION**(p-1)
-
-model.LT_EXP_pw = pyo.Piecewise(model.LT_EXP, model.LT_EXP_COST, model.LT_EXP_ACTION,
-                              pw_pts=bkpts, pw_constr_type='EQ', f_rule=scale_marginal,
+piecewise_representation = 'SOS2'
+
+bkpts = np.concatenate(([0.0],
+                        np.arange(5e3,1.5e5,1e4),
+                        np.arange(1.5e5,4.5e5,5e4),
+                        np.arange(4.5e5,1.1e6,2e5)))
+
+LT_EXP_P = np.array([data['LT_EXP'][i]['p'] for i in _LT_EXP])
+LT_EXP_MULT = np.array([data['LT_EXP'][i]['multiplier'] for i in _LT_EXP])
+
+# marginal cost p*mult*x**(p-1) and its slope over the whole grid x, one row per LT_EXP index
+def scale_marginal(p, mult, x):
+    p, mult = p[:, None], mult[:, None]
+    cost = np.zeros((p.shape[0], x.shape[0]))
+    nonzero = x != 0
+    cost[:, nonzero] = p * mult * x[nonzero]**(p-1)
+    return cost
+
+def scale_marginal_slope(p, mult, x):
+    p, mult = p[:, None], mult[:, None]
+    slope = np.zeros((p.shape[0], x.shape[0]))
+    nonzero = x != 0
+    slope[:, nonzero] = p * (p-1) * mult * x[nonzero]**(p-2)
+    return slope
+
+# marginal cost (and its slope) at each breakpoint, evaluated once for all LT_EXP indices
+LT_EXP_COST_PTS = dict(zip(_LT_EXP, scale_marginal(LT_EXP_P, LT_EXP_MULT, bkpts).tolist()))
+LT_EXP_SLOPE_PTS = dict(zip(_LT_EXP, scale_marginal_slope(LT_EXP_P, LT_EXP_MULT, bkpts).tolist()))
+
+# convex marginal cost curves (p*(p-1)*(p-2) >= 0) get tangent cuts, the rest stay piecewise
+def convex_marginal(LT_EXP):
+    p = data['LT_EXP'][LT_EXP]['p']
+    return p*(p-1)*(p-2) >= 0
+
+model.LT_EXP_TAN = pyo.Set(initialize=[i for i in _LT_EXP if convex_marginal(i)])
+model.LT_EXP_PW = pyo.Set(initialize=[i for i in _LT_EXP if not convex_marginal(i)])
+model.TANGENT = pyo.Set(initialize=range(1, len(bkpts)))
+
+def MarginalCostTangent_rule(model, i, k):
+    b = float(bkpts[k])
+    tangent = LT_EXP_COST_PTS[i][k] + LT_EXP_SLOPE_PTS[i][k]*(model.LT_EXP_ACTION[i] - b)
+    return model.LT_EXP_COST[i] >= tangent
+model.MarginalCostTangent = pyo.Constraint(model.LT_EXP_TAN, model.TANGENT, rule=MarginalCostTangent_rule)
+
+model.LT_EXP_pw = pyo.Piecewise(model.LT_EXP_PW, model.LT_EXP_COST, model.LT_EXP_ACTION,
+                              pw_pts=bkpts.tolist(), pw_constr_type='EQ', f_rule=LT_EXP_COST_PTS,
                               pw_repn=piecewise_representation)
 
 
@@ -153,9 +193,9 @@ model.LT_EXP_pw = pyo.Piecewise(model.LT_EXP, model.LT_EXP_COST, model.LT_EXP_AC
 
 def MeetShortage_rule(model):
     lt_q = model.LT_ACTION['RETRO']
-    exp_vop_q = pyo.quicksum(model.EXP_VOP_ACTION[i]*model.LT_EXP_PERMIT_ACTION[i] for i in model.LT_EXP)
-    st_q = pyo.quicksum(model.ST_ACTION[i] for i in model.ST)
-    short_q = pyo.quicksum(model.SHORT_ACTION[i] for i in model.SHORT_ACTION)
+    exp_vop_q = pyo.sum_product(model.EXP_VOP_Z)
+    st_q = pyo.quicksum(model.ST_ACTION[i] for i in _ST)
+    short_q = pyo.sum_product(model.SHORT_ACTION)
     return  lt_q + st_q + exp_vop_q + short_q >= model.SHORTAGE_Q['SH']
 model.MeetShortage = pyo.Constraint(rule=MeetShortage_rule)
 
@@ -164,13 +204,12 @@ def LongTermMax_rule(model, i):
 model.LongTermMax = pyo.Constraint(model.LT, rule=LongTermMax_rule)
 
 def LongTermExp_rule(model, i):
-    return model.EXP_ACTION[i] / data['LT_EXP'][i]['exp_max'] <= model.LT_EXP_ACTION[i]
+    return model.EXP_ACTION[i] / model.EXP_MAX[i] <= model.LT_EXP_ACTION[i]
 model.LongTermExp = pyo.Constraint(model.LT_EXP, rule=LongTermExp_rule)
 
 def BaselineMinOp_rule(model, i):
     total_lt_exp = model.EXP_ACTION[i] + model.LT_EXP_ACTION[i]
-    min_ratio = data['LT_EXP'][i]['baseline_op_min_ratio']
-    return model.EXP_BOP_ACTION[i] >= min_ratio*total_lt_exp
+    return model.EXP_BOP_ACTION[i] >= model.BASELINE_OP_MIN_RATIO[i]*total_lt_exp
 model.BaselineMinOp = pyo.Constraint(model.LT_EXP, rule=BaselineMinOp_rule)
 
 def BaselineMaxOp_rule(model, i):
@@ -187,6 +226,24 @@ def VariableMaxOp_rule(model, i):
     return model.EXP_VOP_ACTION[i] <= total_lt_exp
 model.VariableMaxOp = pyo.Constraint(model.LT_EXP, rule=VariableMaxOp_rule)
 
+# linearization of EXP_VOP_Z = EXP_VOP_ACTION * LT_EXP_PERMIT_ACTION, with big-M
+# from the bound on EXP_VOP_ACTION implied by VariableMaxOp and LongTermExp
+def exp_vop_max(model, i):
+    return (1 + model.EXP_MAX[i]) * model.LT_EXP_ACTION[i].ub
+model.EXP_VOP_MAX = pyo.Param(model.LT_EXP, within=pyo.NonNegativeReals, initialize=exp_vop_max)
+
+def PermitVariableOpMax_rule(model, i):
+    return model.EXP_VOP_Z[i] <= model.EXP_VOP_MAX[i]*model.LT_EXP_PERMIT_ACTION[i]
+model.PermitVariableOpMax = pyo.Constraint(model.LT_EXP, rule=PermitVariableOpMax_rule)
+
+def PermitVariableOpUpper_rule(model, i):
+    return model.EXP_VOP_Z[i] <= model.EXP_VOP_ACTION[i]
+model.PermitVariableOpUpper = pyo.Constraint(model.LT_EXP, rule=PermitVariableOpUpper_rule)
+
+def PermitVariableOpLower_rule(model, i):
+    return model.EXP_VOP_Z[i] >= model.EXP_VOP_ACTION[i] - model.EXP_VOP_MAX[i]*(1 - model.LT_EXP_PERMIT_ACTION[i])
+model.PermitVariableOpLower = pyo.Constraint(model.LT_EXP, rule=PermitVariableOpLower_rule)
+
 def ShortTermMax_rule(model, k):
     return model.ST_ACTION[k] <= model.ST_MAX[k]
 model.ShortTermMax = pyo.Constraint(model.ST, rule=ShortTermMax_rule)
@@ -211,11 +268,15 @@ model.ShortMax = pyo.Constraint(model.SHORT, rule=ShortMax_rule)
 
 def ComputeFirstStageCost_rule(model):
 
-    lt_actions = pyo.sum_product(model.C_LT, model.LT_ACTION)
+    lt_actions = LinearExpression(constant=0,
+                                  linear_coefs=[model.C_LT[i] for i in _LT],
+                                  linear_vars=[model.LT_ACTION[i] for i in _LT])
 
-    lt_exp_actions = pyo.sum_product(model.LT_EXP_ACTION, model.LT_EXP_COST)
+    lt_exp_actions = pyo.quicksum(model.LT_EXP_ACTION[i]*model.LT_EXP_COST[i] for i in _LT_EXP)
 
-    lt_exp_permit_action = pyo.quicksum(model.LT_EXP_PERMIT_ACTION[i]*model.LT_EXP_PERMIT_COST[i] for i in model.LT_EXP)
+    lt_exp_permit_action = LinearExpression(constant=0,
+                                            linear_coefs=[model.LT_EXP_PERMIT_COST[i] for i in _LT_EXP],
+                                            linear_vars=[model.LT_EXP_PERMIT_ACTION[i] for i in _LT_EXP])
 
     return  lt_actions + lt_exp_actions + lt_exp_permit_action
 
@@ -223,9 +284,9 @@ def ComputeFirstStageCost_rule(model):
 
 def ComputeSecondStageCost_rule(model):
 
-    expansion_cost = pyo.quicksum(model.EXP_ACTION[i]*model.LT_EXP_COST[i] for i in model.LT_EXP)
+    expansion_cost = pyo.quicksum(model.EXP_ACTION[i]*model.LT_EXP_COST[i] for i in _LT_EXP)
 
-    baseline_op_cost = pyo.quicksum(model.EXP_BOP_ACTION[i]*data['LT_EXP'][i]['baseline_op_cost'] for i in model.LT_EXP)
+    baseline_op_cost = pyo.sum_product(model.BASELINE_OP_COST, model.EXP_BOP_ACTION)
 
     return  expansion_cost + baseline_op_cost
 
@@ -235,9 +296,9 @@ def ComputeThirdStageCost_rule(model):
 
     st_actions = pyo.sum_product(model.C_ST, model.ST_ACTION)
 
-    short_cost = pyo.quicksum(model.SHORT_ACTION[i]*model.SHORT_COST[i] for i in model.SHORT_ACTION)
+    short_cost = pyo.sum_product(model.SHORT_COST, model.SHORT_ACTION)
 
-    exp_op_cost = pyo.quicksum(model.EXP_VOP_ACTION[i]*data['LT_EXP'][i]['variable_op_cost'] for i in model.LT_EXP) 
+    exp_op_cost = pyo.sum_product(model.VARIABLE_OP_COST, model.EXP_VOP_ACTION)
 
     return st_actions + short_cost + exp_op_cost
 
@@ -273,20 +334,23 @@ model.Total_Cost_Objective = pyo.Objective(rule=total_cost_rule, sense=pyo.minim
 # Stochastic Data
 #
 
-SHORTAGE_Q = {}
-for projection in data['SHORTAGE_Q']: 
-    SHORTAGE_Q.update(data['SHORTAGE_Q'][projection])
+SHORTAGE_Q = {k: v for d in data['SHORTAGE_Q'].values() for k, v in d.items()}
+
+SHORTAGE_P = {k: v for d in data['SHORTAGE_P'].values() for k, v in d.items()}
+
+PROJECTION_ITEMS = list(data['PROJECTION_P'].items())
 
-SHORTAGE_P = {}
-for projection in data['SHORTAGE_P']: 
-    SHORTAGE_P.update(data['SHORTAGE_P'][projection])
+SHORTAGE_ITEMS = {p: list(data['SHORTAGE_P'][p].items()) for p in data['PROJECTION_P']}
+
+SCENARIO_INDEX = {name: i for i, name in enumerate(SHORTAGE_Q)}
+
+SHORTAGE_Q_ARRAY = np.fromiter((SHORTAGE_Q[name]['SH'] for name in SCENARIO_INDEX), dtype=np.float64)
 
 def pysp_instance_creation_callback(scenario_name, node_names):
     instance = model.clone()
-    instance.SHORTAGE_Q.store_values(SHORTAGE_Q[scenario_name])
-    for i in instance.SHORT:
-        instance.SHORT_Q_MAX[i] = data['SHORT_Q_MAX'][node_names[1]][i]
-        instance.SHORT_COST[i] = data['SHORT_COST'][node_names[1]][i]
+    instance.SHORTAGE_Q['SH'].set_value(float(SHORTAGE_Q_ARRAY[SCENARIO_INDEX[scenario_name]]))
+    instance.SHORT_Q_MAX.store_values(data['SHORT_Q_MAX'][node_names[1]])
+    instance.SHORT_COST.store_values(data['SHORT_COST'][node_names[1]])
     return instance
 
 
@@ -295,8 +359,9 @@ def pysp_instance_creation_callback(scenario_name, node_names):
 # Decision Tree
 #
 
+@functools.lru_cache(maxsize=1)
 def pysp_scenario_tree_model_callback():
-    # Return a NetworkX scenario tree.
+    # Return a NetworkX scenario tree (cached within one import of this module; callers share the graph).
     g = networkx.DiGraph()
 
     ce1 = "CostExpressions[1]"
@@ -308,20 +373,20 @@ def pysp_scenario_tree_model_callback():
                variables = ["LT_ACTION[*]","LT_EXP_ACTION[*]","LT_EXP_PERMIT_ACTION[*]"],
                derived_variables = ["LT_EXP_COST[*]"])
 
-    for projection in data['PROJECTION_P']:
-
-        g.add_node(projection,
-                    cost = ce2,
-                    variables = ["EXP_ACTION[*]","EXP_BOP_ACTION[*]"],
-                    derived_variables = [])
-        g.add_edge("Root", projection, weight=data['PROJECTION_P'][projection])
-
-        for shortage in data['SHORTAGE_P'][projection]:
-
-            g.add_node(shortage,
-                    cost = ce3,
-                    variables = ["ST_ACTION[*]","SHORT_ACTION[*]","EXP_VOP_ACTION[*]"],
-                    derived_variables = [])
-            g.add_edge(projection, shortage, weight=data['SHORTAGE_P'][projection][shortage])
+    g.add_nodes_from([(projection, {"cost": ce2,
+                                     "variables": ["EXP_ACTION[*]","EXP_BOP_ACTION[*]"],
+                                     "derived_variables": []})
+                      for projection, _ in PROJECTION_ITEMS])
+    g.add_edges_from([("Root", projection, {"weight": weight})
+                      for projection, weight in PROJECTION_ITEMS])
+
+    g.add_nodes_from([(shortage, {"cost": ce3,
+                                   "variables": ["ST_ACTION[*]","SHORT_ACTION[*]","EXP_VOP_ACTION[*]"],
+                                   "derived_variables": ["EXP_VOP_Z[*]"]})
+                      for projection, _ in PROJECTION_ITEMS
+                      for shortage, _ in SHORTAGE_ITEMS[projection]])
+    g.add_edges_from([(projection, shortage, {"weight": weight})
+                      for projection, _ in PROJECTION_ITEMS
+                      for shortage, weight in SHORTAGE_ITEMS[projection]])
 
     return g
@@ -11,9 +11,10 @@
 # Imports
 #
 
-import os, json, pickle
+import os, json, pickle, functools
 import networkx 
 import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression
 
 #
 # Model
@@ -49,6 +50,10 @@ model.SHORTAGE_Q = pyo.Param(model.SHORTAGE,
                              initialize=0.0,
                              mutable=True)
 
+# set members materialized once for iteration in rules
+_LT = tuple(data['LT_MAX'])
+_ST = tuple(data['ST_MAX'])
+
 #
 # Variables
 #
@@ -66,8 +71,11 @@ model.ST_Q = pyo.Var(model.ST,
 #
 
 def MeetShortage_rule(model):
-    st_q = pyo.quicksum(model.ST_Q[j] for j in model.ST)
-    return pyo.sum_product(model.LT_QF, model.LT_ACTION) + st_q >= model.SHORTAGE_Q['SH']
+    st_q = pyo.quicksum(model.ST_Q[j] for j in _ST)
+    lt_q = LinearExpression(constant=0,
+                            linear_coefs=[model.LT_QF[i] for i in _LT],
+                            linear_vars=[model.LT_ACTION[i] for i in _LT])
+    return lt_q + st_q >= model.SHORTAGE_Q['SH']
 model.MeetShortage = pyo.Constraint(rule=MeetShortage_rule)
 
 def LongTermMax_rule(model, i):
@@ -86,25 +94,21 @@ def ShortTermOption_rule(model):
     return model.ST_Q['EX_OPTION'] <= model.LT_ACTION['OPTION']
 model.ShortTermOption = pyo.Constraint(rule=ShortTermOption_rule)
 
-def ShortTermNonNegativity_rule(model, j):
-    return model.ST_Q[j] >= 0 
-model.ShortTermNonNegativity = pyo.Constraint(model.ST, rule=ShortTermNonNegativity_rule)
-
-def LongTermNonNegativity_rule(model, i):
-    return model.LT_ACTION[i] >= 0
-model.LongTermNonNegativity = pyo.Constraint(model.LT, rule=LongTermNonNegativity_rule)
-
 #
 # Stage-specific cost computations
 #
 
 def ComputeFirstStageCost_rule(model):
-    return pyo.sum_product(model.C_LT, model.LT_ACTION)
+    return LinearExpression(constant=0,
+                            linear_coefs=[model.C_LT[i] for i in _LT],
+                            linear_vars=[model.LT_ACTION[i] for i in _LT])
 
 model.FirstStageCost = pyo.Expression(rule=ComputeFirstStageCost_rule)
 
 def ComputeSecondStageCost_rule(model):
-    return pyo.sum_product(model.C_ST, model.ST_Q)
+    return LinearExpression(constant=0,
+                            linear_coefs=[model.C_ST[j] for j in _ST],
+                            linear_vars=[model.ST_Q[j] for j in _ST])
 
 model.SecondStageCost = pyo.Expression(rule=ComputeSecondStageCost_rule)
 
@@ -140,8 +144,9 @@ def pysp_instance_creation_callback(scenario_name, node_names):
 
     return instance
 
+@functools.lru_cache(maxsize=1)
 def pysp_scenario_tree_model_callback():
-    # Return a NetworkX scenario tree.
+    # Return a NetworkX scenario tree (cached within one import of this module; callers share the graph).
     g = networkx.DiGraph()
 
     ce1 = "CostExpressions[1]"
@@ -152,11 +157,11 @@ def pysp_scenario_tree_model_callback():
                variables = ["LT_ACTION[*]"],
                derived_variables = [])
 
-    for shortage in SHORTAGE_Q:
-        g.add_node(shortage,
-                cost = ce2,
-                variables = ["ST_Q[*]"],
-                derived_variables = [])
-        g.add_edge("Root", shortage, weight=SHORTAGE_P[shortage])
+    g.add_nodes_from([(shortage, {"cost": ce2,
+                                   "variables": ["ST_Q[*]"],
+                                   "derived_variables": []})
+                      for shortage in SHORTAGE_Q])
+    g.add_edges_from([("Root", shortage, {"weight": SHORTAGE_P[shortage]})
+                      for shortage in SHORTAGE_Q])
 
     return g